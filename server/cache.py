@@ -0,0 +1,55 @@
+"""
+Registry of the server's memoization caches.
+
+Every request-path cache is a plain functools.lru_cache created through `cached`,
+which also records it here so hit/miss counts can be reported and all caches
+cleared from one place.
+"""
+
+from collections.abc import Callable
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, ParamSpec, Protocol, TypeVar, cast
+
+if TYPE_CHECKING:
+    from functools import _CacheInfo, _lru_cache_wrapper
+
+P = ParamSpec("P")
+T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+
+
+class CachedFunction(Protocol[P, T_co]):
+    """An lru_cache wrapper that keeps the wrapped function's signature for type checking."""
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T_co: ...
+
+    def cache_info(self) -> "_CacheInfo": ...
+
+    def cache_clear(self) -> None: ...
+
+
+_CACHES: dict[str, "_lru_cache_wrapper[Any]"] = {}
+
+
+def cached(maxsize: int) -> Callable[[Callable[P, T]], CachedFunction[P, T]]:
+    """lru_cache(maxsize) that registers the wrapped function under its name."""
+    def decorate(fn: Callable[P, T]) -> CachedFunction[P, T]:
+        wrapper = lru_cache(maxsize=maxsize)(fn)
+        _CACHES[fn.__name__] = wrapper
+        return cast(CachedFunction[P, T], wrapper)
+    return decorate
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """Hits, misses and current size of each registered cache, by function name."""
+    out: dict[str, dict[str, int]] = {}
+    for name, wrapper in _CACHES.items():
+        info = wrapper.cache_info()
+        out[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    return out
+
+
+def clear_all() -> None:
+    """Empty every registered cache."""
+    for wrapper in _CACHES.values():
+        wrapper.cache_clear()
@@ -0,0 +1,309 @@
+"""
+Recursive SymPy -> MathML string emitters.
+
+Kept free of closures and dynamic attributes so the module can be compiled
+with mypyc (`mypyc mathml_emit.py`); main.py imports it either way.
+"""
+
+import sympy as sp
+
+MML_NS = "http://www.w3.org/1998/Math/MathML"
+# Pre-built <math> wrappers; concatenated around emitted inner markup
+MML_PREFIX = f'<math xmlns="{MML_NS}">'
+MML_PREFIX_BLOCK = f'<math xmlns="{MML_NS}" display="block">'
+MML_SUFFIX = '</math>'
+
+
+def content_basic(e: sp.Expr) -> str:
+    """Basic Content MathML for e, without the <math> wrapper."""
+    out: list[str] = []
+    _emit_content(e, out)
+    return ''.join(out)
+
+
+def _emit_content(e: sp.Expr, out: list[str]) -> None:
+    """Append content_basic(e) to out as tokens, joined once by the caller."""
+    if isinstance(e, sp.Symbol):
+        out.append(f"<ci>{sp.sstr(e)}</ci>")
+    elif isinstance(e, sp.Integer):
+        out.append(f"<cn>{int(e)}</cn>")
+    elif isinstance(e, sp.Pow):
+        out.append("<apply><power/>")
+        _emit_content(e.base, out)
+        _emit_content(e.exp, out)
+        out.append("</apply>")
+    elif isinstance(e, sp.Add):
+        out.append("<apply><plus/>")
+        for t in e.as_ordered_terms():
+            _emit_content(t, out)
+        out.append("</apply>")
+    elif isinstance(e, sp.Mul):
+        out.append("<apply><times/>")
+        for t in e.as_ordered_factors():
+            _emit_content(t, out)
+        out.append("</apply>")
+    elif isinstance(e, sp.sin):
+        out.append("<apply><sin/>")
+        _emit_content(e.args[0], out)
+        out.append("</apply>")
+    elif isinstance(e, sp.cos):
+        out.append("<apply><cos/>")
+        _emit_content(e.args[0], out)
+        out.append("</apply>")
+    else:
+        start = len(out)
+        try:
+            if isinstance(e, sp.Abs):
+                out.append("<apply><abs/>")
+            elif getattr(e, 'func', None) == sp.conjugate:
+                out.append("<apply><ci>conjugate</ci>")
+            elif getattr(e, 'func', None) == sp.exp:
+                out.append("<apply><exp/>")
+            else:
+                start = -1
+            if start >= 0:
+                _emit_content(e.args[0], out)
+                out.append("</apply>")
+                return
+        except Exception:
+            # Drop whatever the failed branch emitted
+            del out[start:]
+        # Fallback: use sstr as identifier
+        out.append(f"<ci>{sp.sstr(e)}</ci>")
+
+
+def wrap(inner: str) -> str:
+    return MML_PREFIX_BLOCK + inner + MML_SUFFIX
+
+
+def presentation_basic(e: sp.Expr) -> str:
+    """Minimal presentation MathML for: Symbol, Integer, Add, Mul, Pow, sin, cos, Abs, conjugate."""
+    out: list[str] = [MML_PREFIX_BLOCK]
+    spans: dict[int, tuple[int, int]] = {}
+    if isinstance(e, sp.Mul):
+        # Top-level products wrap the first factor in its own <mrow>
+        factors = e.as_ordered_factors()
+        if not factors:
+            out.append("<mn>1</mn>")
+        else:
+            out.append("<mrow><mrow>")
+            _emit_presentation(factors[0], out, spans)
+            out.append("</mrow>")
+            for f in factors[1:]:
+                out.append("<mo>·</mo>")
+                _emit_presentation(f, out, spans)
+            out.append("</mrow>")
+    elif isinstance(e, (sp.Symbol, sp.Integer, sp.Pow, sp.Add, sp.sin, sp.cos)):
+        _emit_presentation(e, out, spans)
+    else:
+        # Abs and conjugate are only rendered at the top level; anything else is <mtext>
+        try:
+            if isinstance(e, sp.Abs):
+                out.append("<mrow><mo>|</mo>")
+                _emit_presentation(e.args[0], out, spans)
+                out.append("<mo>|</mo></mrow>")
+            elif getattr(e, 'func', None) == sp.conjugate:
+                out.append("<mrow><mi>conj</mi><mo>(</mo>")
+                _emit_presentation(e.args[0], out, spans)
+                out.append("<mo>)</mo></mrow>")
+            else:
+                _emit_presentation(e, out, spans)
+        except Exception:
+            del out[1:]
+            out.append(f"<mtext>{sp.sstr(e)}</mtext>")
+    out.append(MML_SUFFIX)
+    return ''.join(out)
+
+
+def presentation_basic_inner(e: sp.Expr) -> str:
+    """Same as presentation_basic but returns inner (no <math> wrapper)."""
+    out: list[str] = []
+    _emit_presentation(e, out, {})
+    return ''.join(out)
+
+
+def _emit_presentation(e: sp.Expr, out: list[str], spans: dict[int, tuple[int, int]]) -> None:
+    """Append presentation_basic_inner(e) to out as tokens, joined once by the caller.
+    spans records where each subterm object was emitted, so a repeated one is copied
+    token-for-token instead of walked again.
+    """
+    key = id(e)
+    span = spans.get(key)
+    if span is not None:
+        out.extend(out[span[0]:span[1]])
+        return
+    start = len(out)
+    if isinstance(e, sp.Symbol):
+        out.append(f"<mi>{sp.sstr(e)}</mi>")
+    elif isinstance(e, sp.Integer):
+        out.append(f"<mn>{int(e)}</mn>")
+    elif isinstance(e, sp.Pow):
+        # Add explicit parentheses around additive bases for clarity
+        out.append("<msup><mrow><mo>(</mo>" if isinstance(e.base, sp.Add) else "<msup><mrow>")
+        _emit_presentation(e.base, out, spans)
+        out.append("<mo>)</mo></mrow>" if isinstance(e.base, sp.Add) else "</mrow>")
+        _emit_presentation(e.exp, out, spans)
+        out.append("</msup>")
+    elif isinstance(e, sp.Add):
+        terms = e.as_ordered_terms()
+        if not terms:
+            out.append("<mn>0</mn>")
+        else:
+            out.append("<mrow>")
+            for i, t in enumerate(terms):
+                if i:
+                    out.append("<mo>+</mo>")
+                _emit_presentation(t, out, spans)
+            out.append("</mrow>")
+    elif isinstance(e, sp.Mul):
+        factors = e.as_ordered_factors()
+        if not factors:
+            out.append("<mn>1</mn>")
+        else:
+            out.append("<mrow>")
+            for i, f in enumerate(factors):
+                if i:
+                    out.append("<mo>·</mo>")
+                _emit_presentation(f, out, spans)
+            out.append("</mrow>")
+    elif isinstance(e, sp.sin):
+        out.append("<mrow><mi>sin</mi><mo>(</mo>")
+        _emit_presentation(e.args[0], out, spans)
+        out.append("<mo>)</mo></mrow>")
+    elif isinstance(e, sp.cos):
+        out.append("<mrow><mi>cos</mi><mo>(</mo>")
+        _emit_presentation(e.args[0], out, spans)
+        out.append("<mo>)</mo></mrow>")
+    else:
+        out.append(f"<mtext>{sp.sstr(e)}</mtext>")
+    spans[key] = (start, len(out))
+
+
+def basic_pair(e: sp.Expr) -> tuple[str, str]:
+    """(content_basic(e), presentation_basic(e)) from a single walk over e.
+    Repeated subterms (same object) are emitted once.
+    """
+    c_out: list[str] = []
+    p_out: list[str] = [MML_PREFIX_BLOCK]
+    spans: dict[int, tuple[int, int, int, int]] = {}
+    if isinstance(e, sp.Mul):
+        factors = e.as_ordered_factors()
+        c_out.append("<apply><times/>")
+        if not factors:
+            p_out.append("<mn>1</mn>")
+        else:
+            p_out.append("<mrow><mrow>")
+            _emit_pair(factors[0], c_out, p_out, spans)
+            p_out.append("</mrow>")
+            for f in factors[1:]:
+                p_out.append("<mo>·</mo>")
+                _emit_pair(f, c_out, p_out, spans)
+            p_out.append("</mrow>")
+        c_out.append("</apply>")
+    elif isinstance(e, (sp.Symbol, sp.Integer, sp.Pow, sp.Add, sp.sin, sp.cos)):
+        _emit_pair(e, c_out, p_out, spans)
+    else:
+        # Top-level only: presentation_basic renders Abs and conjugate, presentation_basic_inner does not
+        done = False
+        try:
+            if isinstance(e, sp.Abs):
+                c_out.append("<apply><abs/>")
+                p_out.append("<mrow><mo>|</mo>")
+                _emit_pair(e.args[0], c_out, p_out, spans)
+                c_out.append("</apply>")
+                p_out.append("<mo>|</mo></mrow>")
+                done = True
+            elif getattr(e, 'func', None) == sp.conjugate:
+                c_out.append("<apply><ci>conjugate</ci>")
+                p_out.append("<mrow><mi>conj</mi><mo>(</mo>")
+                _emit_pair(e.args[0], c_out, p_out, spans)
+                c_out.append("</apply>")
+                p_out.append("<mo>)</mo></mrow>")
+                done = True
+        except Exception:
+            del c_out[:]
+            del p_out[1:]
+            spans.clear()
+        if not done:
+            _emit_pair(e, c_out, p_out, spans)
+    p_out.append(MML_SUFFIX)
+    return ''.join(c_out), ''.join(p_out)
+
+
+def _emit_pair(
+    e: sp.Expr,
+    c_out: list[str],
+    p_out: list[str],
+    spans: dict[int, tuple[int, int, int, int]],
+) -> None:
+    """Append content_basic(e) to c_out and presentation_basic_inner(e) to p_out.
+    spans records where each subterm object was emitted in both buffers, so a repeated
+    one is copied token-for-token instead of walked again.
+    """
+    key = id(e)
+    span = spans.get(key)
+    if span is not None:
+        c_out.extend(c_out[span[0]:span[1]])
+        p_out.extend(p_out[span[2]:span[3]])
+        return
+    c_start = len(c_out)
+    p_start = len(p_out)
+    if isinstance(e, sp.Symbol):
+        name = sp.sstr(e)
+        c_out.append(f"<ci>{name}</ci>")
+        p_out.append(f"<mi>{name}</mi>")
+    elif isinstance(e, sp.Integer):
+        c_out.append(f"<cn>{int(e)}</cn>")
+        p_out.append(f"<mn>{int(e)}</mn>")
+    elif isinstance(e, sp.Pow):
+        c_out.append("<apply><power/>")
+        p_out.append("<msup><mrow><mo>(</mo>" if isinstance(e.base, sp.Add) else "<msup><mrow>")
+        _emit_pair(e.base, c_out, p_out, spans)
+        p_out.append("<mo>)</mo></mrow>" if isinstance(e.base, sp.Add) else "</mrow>")
+        _emit_pair(e.exp, c_out, p_out, spans)
+        c_out.append("</apply>")
+        p_out.append("</msup>")
+    elif isinstance(e, sp.Add):
+        terms = e.as_ordered_terms()
+        c_out.append("<apply><plus/>")
+        if not terms:
+            p_out.append("<mn>0</mn>")
+        else:
+            p_out.append("<mrow>")
+            for i, t in enumerate(terms):
+                if i:
+                    p_out.append("<mo>+</mo>")
+                _emit_pair(t, c_out, p_out, spans)
+            p_out.append("</mrow>")
+        c_out.append("</apply>")
+    elif isinstance(e, sp.Mul):
+        factors = e.as_ordered_factors()
+        c_out.append("<apply><times/>")
+        if not factors:
+            p_out.append("<mn>1</mn>")
+        else:
+            p_out.append("<mrow>")
+            for i, f in enumerate(factors):
+                if i:
+                    p_out.append("<mo>·</mo>")
+                _emit_pair(f, c_out, p_out, spans)
+            p_out.append("</mrow>")
+        c_out.append("</apply>")
+    elif isinstance(e, sp.sin):
+        c_out.append("<apply><sin/>")
+        p_out.append("<mrow><mi>sin</mi><mo>(</mo>")
+        _emit_pair(e.args[0], c_out, p_out, spans)
+        c_out.append("</apply>")
+        p_out.append("<mo>)</mo></mrow>")
+    elif isinstance(e, sp.cos):
+        c_out.append("<apply><cos/>")
+        p_out.append("<mrow><mi>cos</mi><mo>(</mo>")
+        _emit_pair(e.args[0], c_out, p_out, spans)
+        c_out.append("</apply>")
+        p_out.append("<mo>)</mo></mrow>")
+    else:
+        # presentation_basic_inner has no Abs/conjugate/exp cases; only the content side does
+        text = sp.sstr(e)
+        _emit_content(e, c_out)
+        p_out.append(f"<mtext>{text}</mtext>")
+    spans[key] = (c_start, len(c_out), p_start, len(p_out))
@@ -13,6 +13,7 @@ class ExpressionFormat(str, Enum):
     MATHML = "mathml"
     SYMPY = "sympy"
     PLAIN_TEXT = "plain_text"
+    NUMERIC = "numeric"  # /api/parse output only: evaluate at the given variable values
 
 
 class RewriteRule(str, Enum):
@@ -38,6 +39,9 @@ class ParseRequest(BaseModel):
         default=ExpressionFormat.MATHML,
         description="Desired output format"
     )
+    variables: Optional[Dict[str, float]] = Field(
+        None, description="Variable values for numeric output"
+    )
 
 
 class ParseResponse(BaseModel):
@@ -95,10 +99,10 @@ class RewriteResponse(BaseModel):
         default=[], description="Step-by-step rewriting process"
     )
     mathml_output: Optional[str] = Field(
-        None, description="Final expression in MathML format"
+        None, description="Final expression in MathML format (only when output_format is mathml)"
     )
     latex_output: Optional[str] = Field(
-        None, description="Final expression in LaTeX format"
+        None, description="Final expression in LaTeX format (only when output_format is latex)"
     )
     error_message: Optional[str] = Field(
         None, description="Error message if rewriting failed"
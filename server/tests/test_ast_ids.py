@@ -0,0 +1,93 @@
+from main import (
+    ASTNode, _ast_children, _ast_to_sympy, _canonical, _find_node_by_id,
+    _parse_content_mathml_to_ast, _parse_content_mathml_to_sympy, _parse_mathml_root, _with_ids,
+)
+
+
+def wrap(core: str) -> str:
+    return f'<math xmlns="http://www.w3.org/1998/Math/MathML">{core}</math>'
+
+
+def djb2_hex(s: str) -> str:
+    # Reference: the frontend's djb2Hex over the whole canonical string
+    h = 5381
+    for ch in s:
+        h = (h * 33 + ord(ch)) & 0xFFFFFFFF
+    return format(h, 'x')
+
+
+def all_nodes(ast):
+    stack, seen = [ast], []
+    while stack:
+        node = stack.pop()
+        if not any(node is s for s in seen):
+            seen.append(node)
+            stack.extend(_ast_children(node))
+    return seen
+
+
+def test_node_ids_match_frontend_djb2_of_canonical():
+    # sin(x^2 + 6x) * (x^2 + 6x) + θ: repeated subtrees, a product, a non-ASCII name
+    square_plus = '<apply><plus/><apply><power/><ci>x</ci><cn>2</cn></apply><apply><times/><cn>6</cn><ci>x</ci></apply></apply>'
+    content = wrap(
+        '<apply><plus/>'
+        f'<apply><times/><apply><sin/>{square_plus}</apply>{square_plus}</apply>'
+        '<ci>θ</ci>'
+        '</apply>'
+    )
+    ast = _parse_content_mathml_to_ast(content)
+    nodes = all_nodes(ast)
+    assert len(nodes) > 8
+    for node in nodes:
+        assert node.id == djb2_hex(_canonical(node))
+        assert ast.nodes[node.id] is node
+
+
+def test_with_ids_on_unparsed_tree():
+    x = ASTNode('ident', name='x')
+    ast = ASTNode('call', func='cos', arg=ASTNode('power', base=x, exponent=ASTNode('number', value='3')))
+    _with_ids(ast)
+    for node in all_nodes(ast):
+        assert node.id == djb2_hex(_canonical(node))
+
+
+def test_find_node_by_id_walks_unparsed_trees_in_preorder():
+    x = ASTNode('ident', name='x')
+    ast = _with_ids(ASTNode('add', terms=(
+        ASTNode('power', base=x, exponent=ASTNode('number', value='2')),
+        ASTNode('call', func='sin', arg=ASTNode('ident', name='x')),
+    )))
+    # ast has no nodes table, so this is the pre-order walk; the first x wins
+    for node in all_nodes(ast):
+        assert _find_node_by_id(ast, node.id) is (x if node.id == x.id else node)
+
+
+def test_ast_to_sympy_handles_trees_deeper_than_the_recursion_limit():
+    ast = ASTNode('ident', name='x')
+    for _ in range(3000):
+        ast = ASTNode('call', func='f', arg=ast)
+    expr = _ast_to_sympy(ast)
+    assert expr.func.__name__ == 'f'
+
+
+def test_parsers_share_one_parsed_element():
+    content = wrap('<apply><sin/><apply><times/><cn>2</cn><ci>x</ci></apply></apply>')
+    root = _parse_mathml_root(content)
+    assert _ast_to_sympy(_parse_content_mathml_to_ast(root)) == _parse_content_mathml_to_sympy(root)
+    assert _parse_content_mathml_to_ast(root).id == _parse_content_mathml_to_ast(content).id
+
+
+def test_ast_to_sympy_shares_reordered_products():
+    # sin(x*y) + cos(y*x): the two products differ only in factor order
+    content = wrap(
+        '<apply><plus/>'
+        '<apply><sin/><apply><times/><ci>x</ci><ci>y</ci></apply></apply>'
+        '<apply><cos/><apply><times/><ci>y</ci><ci>x</ci></apply></apply>'
+        '</apply>'
+    )
+    ast = _parse_content_mathml_to_ast(content)
+    xy, yx = (term.arg for term in ast.terms)
+    assert xy is not yx
+    memo: dict = {}
+    _ast_to_sympy(ast, memo)
+    assert memo[id(xy)] is memo[id(yx)]
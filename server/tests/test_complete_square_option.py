@@ -21,3 +21,32 @@ def test_complete_square_option_present():
     assert resp.status_code == 200
     opts = resp.json().get('options', [])
     assert any(o.get('ruleName') == 'complete_square' for o in opts), opts
+
+
+def test_complete_square_option_keeps_square_form():
+    # x^2 + x -> (x + 1/2)^2 - 1/4, not re-simplified back to x*(x + 1)
+    content = wrap(
+        '<apply><plus/>'
+        '<apply><power/><ci>x</ci><cn>2</cn></apply>'
+        '<ci>x</ci>'
+        '</apply>'
+    )
+    resp = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert resp.status_code == 200
+    opts = resp.json().get('options', [])
+    cs = [o for o in opts if o.get('ruleName') == 'complete_square']
+    assert any('(x + 1/2)**2 - 1/4' in (o.get('replacementContentMathML') or '') for o in cs), opts
+
+
+def test_complete_square_option_absent_when_already_completed():
+    # (x + 3)^2 - 4 is already in completed form
+    content = wrap(
+        '<apply><plus/>'
+        '<apply><power/><apply><plus/><ci>x</ci><cn>3</cn></apply><cn>2</cn></apply>'
+        '<cn>-4</cn>'
+        '</apply>'
+    )
+    resp = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert resp.status_code == 200
+    opts = resp.json().get('options', [])
+    assert not any(o.get('ruleName') == 'complete_square' for o in opts), opts
@@ -2,9 +2,16 @@
 Tests for the main FastAPI application endpoints.
 """
 
+import asyncio
+import gc
+import os
+import signal
+import threading
+
 import pytest
 from fastapi.testclient import TestClient
-from main import app
+import main
+from main import app, lifespan
 from schemas import ParseRequest, RewriteRequest, RewriteRule, ExpressionFormat
 
 client = TestClient(app)
@@ -32,6 +39,18 @@ def test_health_check_endpoint():
     assert "lxml" in data["services"]
 
 
+def test_health_check_deep_reprobes():
+    """?deep=1 re-runs the SymPy/lxml probes and reports cache statistics."""
+    response = client.get("/health", params={"deep": 1})
+    assert response.status_code == 200
+    services = response.json()["services"]
+    assert services["sympy"].startswith("OK")
+    assert services["lxml"].startswith("OK")
+    caches = response.json()["caches"]
+    assert set(caches["_parse_input_expression"]) == {"hits", "misses", "size"}
+    assert client.get("/health").json()["caches"] is None
+
+
 def test_parse_endpoint_basic():
     """Test basic parsing functionality."""
     request_data = {
@@ -47,6 +66,35 @@ def test_parse_endpoint_basic():
     assert "x" in data["variables"]
 
 
+def test_parse_endpoint_numeric_output():
+    """Numeric output evaluates the expression at the supplied variable values."""
+    request_data = {
+        "expression": "x**2 + 2*x + 1",
+        "input_format": "plain_text",
+        "output_format": "numeric",
+        "variables": {"x": 2}
+    }
+    response = client.post("/api/parse", json=request_data)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert float(data["parsed_expression"]) == 9.0
+
+    del request_data["variables"]
+    data = client.post("/api/parse", json=request_data).json()
+    assert data["success"] is False
+    assert "x" in data["error_message"]
+
+
+def test_numeric_format_rejected_outside_parse_output():
+    """numeric is only an /api/parse output format."""
+    parse = client.post("/api/parse", json={"expression": "x", "input_format": "numeric"})
+    assert parse.status_code == 400
+    for formats in ({"output_format": "numeric"}, {"input_format": "numeric"}):
+        request_data = {"expression": "x + x", "rules": ["simplify"], **formats}
+        assert client.post("/api/rewrite", json=request_data).status_code == 400
+
+
 def test_parse_endpoint_error_handling():
     """Test parse endpoint error handling with invalid expression."""
     request_data = {
@@ -79,6 +127,56 @@ def test_rewrite_endpoint_basic():
     assert data["steps"][0]["rule"] == "factor"
 
 
+def test_rewrite_collect_uses_first_variable_by_name():
+    """Collect picks its variable deterministically rather than by set order."""
+    request_data = {
+        "expression": "b*c + a*b + a*c",
+        "rules": ["collect"],
+        "input_format": "plain_text",
+        "output_format": "sympy"
+    }
+    response = client.post("/api/rewrite", json=request_data)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["steps"][0]["description"] == "Collected terms with respect to a"
+
+
+def test_rewrite_renders_only_requested_format():
+    """Only the requested output format is rendered into the response."""
+    request_data = {
+        "expression": "(x + 1)^2",
+        "rules": ["expand"],
+        "input_format": "plain_text",
+        "output_format": "sympy"
+    }
+    data = client.post("/api/rewrite", json=request_data).json()
+    assert data["success"] is True
+    assert data["final_expression"] == "x**2 + 2*x + 1"
+    assert data["latex_output"] is None
+    assert data["mathml_output"] is None
+
+    request_data["output_format"] = "latex"
+    data = client.post("/api/rewrite", json=request_data).json()
+    assert data["latex_output"] == data["final_expression"]
+    assert data["mathml_output"] is None
+
+
+def test_rewrite_repeated_rule_keeps_every_step():
+    """A rule repeated on its own output is skipped internally but still reported."""
+    request_data = {
+        "expression": "(x + 1)^2",
+        "rules": ["expand", "expand", "factor", "factor"],
+        "input_format": "plain_text",
+        "output_format": "sympy"
+    }
+    data = client.post("/api/rewrite", json=request_data).json()
+    assert data["success"] is True
+    assert [s["rule"] for s in data["steps"]] == request_data["rules"]
+    assert data["steps"][1]["expression_after"] == "x**2 + 2*x + 1"
+    assert data["final_expression"] == "(x + 1)**2"
+
+
 def test_rewrite_endpoint_multiple_rules():
     """Test rewrite with multiple rules."""
     request_data = {
@@ -108,4 +206,92 @@ def test_rewrite_endpoint_error_handling():
     assert response.status_code == 200
     data = response.json()
     assert data["success"] is False
-    assert data["error_message"] is not None
\ No newline at end of file
+    assert data["error_message"] is not None
+
+
+def test_rewrite_endpoint_complete_square_keeps_square_form():
+    """Completing the square must not be folded back into a factored form."""
+    request_data = {
+        "expression": "x**2 + x",
+        "rules": ["complete_square"],
+        "input_format": "plain_text",
+        "output_format": "sympy"
+    }
+    response = client.post("/api/rewrite", json=request_data)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["final_expression"] == "(x + 1/2)**2 - 1/4"
+
+
+def test_parse_endpoint_rejects_overlong_expression():
+    """Test parse endpoint rejects expressions above the length limit."""
+    request_data = {
+        "expression": "x+" * 3000 + "1",
+        "input_format": "plain_text",
+        "output_format": "latex"
+    }
+    response = client.post("/api/parse", json=request_data)
+    assert response.status_code == 400
+
+
+def test_rewrite_endpoint_rejects_overlong_expression():
+    """Test rewrite endpoint rejects expressions above the length limit."""
+    request_data = {
+        "expression": "x+" * 3000 + "1",
+        "rules": ["simplify"],
+        "input_format": "plain_text",
+        "output_format": "latex"
+    }
+    response = client.post("/api/rewrite", json=request_data)
+    assert response.status_code == 400
+
+
+def test_startup_freezes_long_lived_objects():
+    """The lifespan hook moves startup objects out of the collector's reach."""
+    try:
+        with TestClient(app) as started:
+            assert started.get("/health").status_code == 200
+            assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+
+
+def test_sighup_reload_handler_lives_only_as_long_as_the_app():
+    """Importing main leaves SIGHUP alone; the lifespan installs the reload handler and restores it."""
+
+    async def run() -> object:
+        async with lifespan(app):
+            return signal.getsignal(signal.SIGHUP)
+
+    assert signal.getsignal(signal.SIGHUP) == signal.SIG_DFL
+    try:
+        assert asyncio.run(run()) != signal.SIG_DFL
+    finally:
+        gc.unfreeze()
+    assert signal.getsignal(signal.SIGHUP) == signal.SIG_DFL
+
+
+def test_sighup_reloads_rules_off_the_event_loop(monkeypatch):
+    reloaded = threading.Event()
+    threads = []
+
+    def fake_reload() -> None:
+        threads.append(threading.current_thread())
+        reloaded.set()
+
+    monkeypatch.setattr(main, 'reload_rewrite_rules', fake_reload)
+
+    async def run() -> None:
+        async with main.lifespan(app):
+            os.kill(os.getpid(), signal.SIGHUP)
+            for _ in range(500):
+                if reloaded.is_set():
+                    break
+                await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(run())
+    finally:
+        gc.unfreeze()
+    assert threads and threads[0] is not threading.main_thread()
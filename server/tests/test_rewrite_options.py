@@ -1,5 +1,12 @@
+import sympy as sp
 from fastapi.testclient import TestClient
-from main import app
+from sympy.polys.polyerrors import CoercionFailed
+import main
+from cache import stats
+from main import (
+    MAX_CONTENT_MATHML_LENGTH, app, reload_rewrite_rules, _djb2_digest, _normalize_content_mathml,
+    _parse_content_mathml_to_ast_cached, _selection_options_json,
+)
 
 client = TestClient(app)
 
@@ -33,3 +40,100 @@ def test_rewrite_options_log_power_pullout():
     data = resp.json()
     opts = data.get('options', [])
     assert any(o.get('ruleName') == 'log_power_pullout' for o in opts), opts
+
+
+def test_rewrite_options_rejects_arcsin_instead_of_reading_sin():
+    # <arcsin/> must not be matched as <sin/> by its tag suffix
+    content = wrap('<apply><arcsin/><apply><times/><cn>2</cn><ci>x</ci></apply></apply>')
+    resp = client.post('/rewriteOptions', json={
+        'contentMathML': content,
+        'selectedNodeId': 'does-not-exist'
+    })
+    assert resp.status_code == 400
+    assert resp.json()['detail'].endswith('Unsupported operator: arcsin')
+
+
+def test_rewrite_options_escaped_content_matches_plain():
+    # Parsed ASTs are cached on the unescaped, stripped content; both spellings must agree
+    content = wrap('<apply><sin/><apply><times/><cn>2</cn><ci>x</ci></apply></apply>')
+    escaped = '  ' + content.replace('<', '&lt;').replace('>', '&gt;') + '\n'
+    plain = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    again = client.post('/rewriteOptions', json={'contentMathML': escaped, 'selectedNodeId': 'root'})
+    assert plain.status_code == again.status_code == 200
+    assert plain.json() == again.json()
+
+
+def test_rewrite_options_rejects_oversized_content_before_caching():
+    content = wrap('<ci>x</ci>' + ' ' * MAX_CONTENT_MATHML_LENGTH)
+    misses = (_selection_options_json.cache_info().misses, _parse_content_mathml_to_ast_cached.cache_info().misses)
+    resp = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert resp.status_code == 400
+    assert 'too long' in resp.json()['detail']
+    assert (_selection_options_json.cache_info().misses, _parse_content_mathml_to_ast_cached.cache_info().misses) == misses
+
+
+def test_rewrite_options_selects_subtree_by_node_id():
+    # sin(2x) + 1: the double-angle option only applies to the selected sin(2x) node
+    sin2x = '<apply><sin/><apply><times/><cn>2</cn><ci>x</ci></apply></apply>'
+    content = wrap(f'<apply><plus/>{sin2x}<cn>1</cn></apply>')
+    node_id = format(_djb2_digest('call:sin(call:times(add(number:2,ident:x)))')[0], 'x')
+    whole = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    selected = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': node_id})
+    assert whole.status_code == selected.status_code == 200
+    assert not any(o.get('ruleName') == 'trig_double_angle_sin' for o in whole.json()['options'])
+    assert any(o.get('ruleName') == 'trig_double_angle_sin' for o in selected.json()['options'])
+
+
+def test_rewrite_options_reports_response_cache_hits():
+    content = wrap('<apply><plus/><apply><power/><ci>q</ci><cn>3</cn></apply><cn>7</cn></apply>')
+    first = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    again = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert first.headers['X-Cache'] == 'MISS'
+    assert again.headers['X-Cache'] == 'HIT'
+    assert first.json() == again.json()
+
+
+def test_reload_rewrite_rules_clears_every_cache():
+    content = wrap('<apply><plus/><apply><power/><ci>r</ci><cn>3</cn></apply><cn>5</cn></apply>')
+    client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    reload_rewrite_rules()
+    assert all(s['size'] == 0 for s in stats().values())
+    after = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert after.headers['X-Cache'] == 'MISS'
+
+
+def test_results_computed_against_replaced_rules_are_never_served():
+    content = wrap('<apply><plus/><apply><power/><ci>q</ci><cn>3</cn></apply><cn>7</cn></apply>')
+    old_rules = main.LOADED_RULES
+    main.reload_rewrite_rules()
+    # A request that read the old rule set finishes after the reload cleared the caches
+    main._selection_options_json(content, '', None, old_rules)
+    resp = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert resp.headers['X-Cache'] == 'MISS'
+
+
+def test_polys_errors_drop_the_option_instead_of_failing(monkeypatch):
+    def fail(*_args, **_kwargs):
+        raise CoercionFailed('cannot coerce')
+
+    monkeypatch.setattr(sp.Poly, 'all_coeffs', fail)
+    content = wrap('<apply><plus/><apply><power/><ci>u</ci><cn>2</cn></apply><cn>9</cn></apply>')
+    resp = client.post('/rewriteOptions', json={'contentMathML': content, 'selectedNodeId': 'root'})
+    assert resp.status_code == 200
+    assert not any(o['ruleName'] == 'complete_square_auto' for o in resp.json()['options'])
+
+
+def test_rules_cache_written_outside_source_tree_and_keyed_on_builder(tmp_path, monkeypatch):
+    cache_path = tmp_path / 'cache' / 'rules.cache.pkl'
+    rules = main._load_rewrite_rules_cached(main._RULES_DIR, cache_path)
+    assert cache_path.exists() and rules
+    # Changing the rule-building code must not reuse the old pickle
+    monkeypatch.setattr(main, '_rule_builder_hash', lambda: 'changed')
+    monkeypatch.setattr(main, '_load_rewrite_rules_from_dir', lambda _dir: [])
+    assert main._load_rewrite_rules_cached(main._RULES_DIR, cache_path) == []
+
+
+def test_content_mathml_is_unescaped_only_once():
+    # A literal &amp;lt; in escaped input is the text &lt; in the MathML, i.e. '<' in the identifier
+    content = wrap('<ci>a&amp;lt;b</ci>')
+    assert _parse_content_mathml_to_ast_cached(_normalize_content_mathml(content)).name == 'a<b'